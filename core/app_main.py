@@ -1,26 +1,52 @@
 APP_VERSION = 'unifamiliar-v5'
+
+# Tooltip do zoneamento: um rótulo por campo (sem repetir "Sigla"/"Nome").
+# Os mesmos campos são garantidos em todas as features no carregamento.
+ZONE_TOOLTIP_FIELDS = ("sigla", "zona", "zona_sigla", "name")
+ZONE_TOOLTIP_ALIASES = ("Sigla: ", "Zona: ", "Sigla Zona: ", "Nome: ")
+
+# Precedência das chaves de cada campo nas properties dos GeoJSON (resolvida
+# uma vez por feature no carregamento dos índices).
+ZONE_SIGLA_KEYS = ("sigla", "SIGLA", "zona_sigla", "ZONA_SIGLA", "name")
+ZONE_NOME_KEYS = ("zona", "ZONA", "nome", "NOME")
+RUA_NOME_KEYS = ("log_ofic", "LOG_OFIC", "name", "NOME")
+RUA_HIERARQUIA_KEYS = ("hierarquia", "HIERARQUIA")
+
+# Variantes de chave vistas nos GeoJSON de zoneamento -> chave canônica
+# (a do tooltip). Dobradas no carregamento quando a canônica falta ou está vazia.
+ZONE_KEY_ALIASES = {"SIGLA": "sigla", "ZONA": "zona", "ZONA_SIGLA": "zona_sigla", "NOME": "name", "nome": "name", "NAME": "name"}
+
+# "1.234,56" -> "1234.56" (número pt-BR para float)
+_PT_BR_DECIMAL = str.maketrans({".": None, ",": "."})
+
+# Popup do marcador antes do cálculo (texto fixo).
+_EMPTY_POPUP_HTML = """
+<div style="font-family: Arial, sans-serif; font-size: 13px; line-height: 1.35; min-width:260px;">
+  <div style="font-weight:700; font-size:14px; margin-bottom:6px;">Ponto selecionado</div>
+  <div style="color:#666;">Preencha os dados e clique em <b>Gerar Estudo</b> para ver zona, rua e índices.</div>
+</div>
+"""
+
 def main():
     import os
     import json
+    import pickle
     import math
     import re
+    import threading
+    import zlib
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
     from pathlib import Path
     from typing import Optional, Dict, Any, Tuple
-    from numbers import Integral
     
+    # Só o essencial no topo: folium/streamlit_folium, shapely/pyproj e supabase
+    # são importados perto do primeiro uso, para o título e o CSS aparecerem antes.
     import streamlit as st
-    import folium
-    from streamlit_folium import st_folium
-    
-    from shapely.geometry import shape, Point
-    from shapely.ops import transform
-    from shapely.prepared import prep
-    from shapely.strtree import STRtree
-    from pyproj import Transformer
-    
-    from supabase import create_client
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
     from core.report_unifamiliar import build_unifamiliar_report_md
+    from core.urban_calc import envelope_area, urbanism_math
     
     
     # =============================
@@ -33,7 +59,8 @@ def main():
     ZONE_FILE = DATA_DIR / "zoneamento_light.json"
     RUAS_FILE = DATA_DIR / "ruas.json"
     
-    _to_3857 = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True).transform
+    MAP_CENTER = [-3.69, -40.35]  # Sobral
+    MAP_ZOOM = 13
     
     
     # =============================
@@ -74,6 +101,14 @@ def main():
             border-radius: 12px;
             margin-top: 10px;
           }
+          .grid3 {
+            display: grid;
+            grid-template-columns: repeat(3, 1fr);
+            gap: 16px;
+          }
+          @media (max-width: 640px) {
+            .grid3 { grid-template-columns: 1fr; }
+          }
           .sidebar-section {
             padding: 6px 0 14px 0;
             border-bottom: 1px solid rgba(49, 51, 63, 0.10);
@@ -94,6 +129,7 @@ def main():
         key = st.secrets.get("SUPABASE_ANON_KEY") or os.getenv("SUPABASE_ANON_KEY")
         if not url or not key:
             return None
+        from supabase import create_client
         return create_client(url, key)
     
     
@@ -103,10 +139,31 @@ def main():
         st.stop()
     
     
+    def run_parallel(*calls):
+        """
+        Executa consultas independentes ao Supabase em paralelo: cada chamada é
+        um round-trip HTTP, então o tempo total cai de soma para máximo.
+        As threads recebem o contexto do script para os caches do Streamlit funcionarem.
+        Falha numa chamada vira None naquela posição (as outras seguem).
+        """
+        ctx = get_script_run_ctx()
+    
+        def _call(call):
+            add_script_run_ctx(threading.current_thread(), ctx)
+            fn, *args = call
+            try:
+                return fn(*args)
+            except Exception:
+                return None
+    
+        with ThreadPoolExecutor(max_workers=len(calls)) as ex:
+            return list(ex.map(_call, calls))
+    
+    
     # =============================
     # Utils
     # =============================
-    def get_prop(props: dict, *keys) -> str:
+    def get_prop(props: dict, keys: Tuple[str, ...]) -> str:
         props = props or {}
         for k in keys:
             if k in props and props[k] not in (None, ""):
@@ -121,26 +178,15 @@ def main():
         ]
         if not sigla:
             return "#3388ff"
-        idx = sum(ord(c) for c in sigla) % len(palette)
+        # crc32 e não hash(): hash de str muda a cada processo (PYTHONHASHSEED)
+        # e as cores das zonas mudariam a cada restart do app
+        idx = zlib.crc32(sigla.encode("utf-8")) % len(palette)
         return palette[idx]
     
     
     def zone_style(feat):
-        props = (feat or {}).get("properties") or {}
-        sigla = get_prop(props, "sigla", "SIGLA", "zona_sigla", "ZONA_SIGLA", "name")
-        return {"fillColor": color_for_zone(sigla), "color": "#222222", "weight": 1, "fillOpacity": 0.30}
-    
-    
-    def ensure_properties_keys(geojson: dict, keys: Tuple[str, ...]) -> dict:
-        z = json.loads(json.dumps(geojson))
-        feats = (z or {}).get("features") or []
-        for feat in feats:
-            props = feat.get("properties") or {}
-            feat["properties"] = props
-            for k in keys:
-                if k not in props or props[k] is None:
-                    props[k] = ""
-        return z
+        # cor calculada uma vez no carregamento (load_and_index_zones)
+        return {"fillColor": feat["properties"]["_fill_color"], "color": "#222222", "weight": 1, "fillOpacity": 0.30}
     
     
     def fmt_pct(x: Optional[float]) -> str:
@@ -218,12 +264,7 @@ def main():
     
     def popup_html(result: dict | None):
         if not result:
-            return """
-            <div style="font-family: Arial, sans-serif; font-size: 13px; line-height: 1.35; min-width:260px;">
-              <div style="font-weight:700; font-size:14px; margin-bottom:6px;">Ponto selecionado</div>
-              <div style="color:#666;">Preencha os dados e clique em <b>Gerar Estudo</b> para ver zona, rua e índices.</div>
-            </div>
-            """
+            return _EMPTY_POPUP_HTML
     
         zona_nome = result.get("zona_nome") or "—"
         zona_sigla = result.get("zona_sigla") or "—"
@@ -242,63 +283,6 @@ def main():
         """
     
     
-    def envelope_area(
-        testada: float,
-        profundidade: float,
-        rec_fr: float,
-        rec_fun: float,
-        rec_lat: float,
-        esquina: bool,
-        corner_two_fronts: bool,
-        attach_one_side: bool,
-    ) -> Dict[str, Any]:
-        testada = float(testada)
-        profundidade = float(profundidade)
-        rec_fr = float(rec_fr)
-        rec_fun = float(rec_fun)
-        rec_lat = float(rec_lat)
-    
-        if not esquina:
-            lat_internal = rec_lat
-            lat_other = rec_lat
-            if attach_one_side:
-                lat_internal = 0.0
-            largura_util = max(testada - (lat_internal + lat_other), 0.0)
-            prof_util = max(profundidade - rec_fr - rec_fun, 0.0)
-            return {
-                "largura_util": largura_util,
-                "prof_util": prof_util,
-                "area_miolo": largura_util * prof_util,
-                "esquina_modelo": "meio_quadra",
-            }
-    
-        if corner_two_fronts:
-            lat_internal = rec_lat
-            if attach_one_side:
-                lat_internal = 0.0
-            largura_util = max(testada - (lat_internal + rec_fr), 0.0)
-            prof_util = max(profundidade - rec_fr - rec_fun, 0.0)
-            return {
-                "largura_util": largura_util,
-                "prof_util": prof_util,
-                "area_miolo": largura_util * prof_util,
-                "esquina_modelo": "esquina_2_frentes",
-            }
-    
-        lat_internal = rec_lat
-        lat_other = rec_lat
-        if attach_one_side:
-            lat_internal = 0.0
-        largura_util = max(testada - (lat_internal + lat_other), 0.0)
-        prof_util = max(profundidade - rec_fr - rec_fun, 0.0)
-        return {
-            "largura_util": largura_util,
-            "prof_util": prof_util,
-            "area_miolo": largura_util * prof_util,
-            "esquina_modelo": "esquina_sem_2_frentes",
-        }
-    
-    
     # =============================
     # Sanitários (Anexo III) + Estacionamento v2 (Anexo IV)
     # =============================
@@ -309,7 +293,7 @@ def main():
         m = re.search(r"1\s*/\s*([\d\.,]+)\s*m", formula)
         if not m:
             return None
-        raw = m.group(1).replace(".", "").replace(",", ".")
+        raw = m.group(1).translate(_PT_BR_DECIMAL)
         try:
             return float(raw)
         except Exception:
@@ -525,157 +509,248 @@ def main():
     # =============================
     # GeoJSON load / indexes
     # =============================
-    @st.cache_data(show_spinner=False)
-    def load_geojson(path: Path):
+    import numpy as np
+    import shapely
+    from shapely.geometry import shape, mapping, Point
+    from shapely.strtree import STRtree
+    from pyproj import Transformer
+    
+    # folhas pequenas: poucas centenas de zonas / alguns milhares de ruas,
+    # consultadas um ponto por vez
+    STRTREE_NODE_CAPACITY = 10
+    
+    # só para desenhar: ~5 m em graus (EPSG:4326). O clique usa a geometria original.
+    ZONE_DISPLAY_SIMPLIFY_TOL = 0.00005
+    
+    # main() roda a cada rerun: o Transformer (carrega o banco do PROJ) é criado
+    # uma vez por processo e compartilhado entre sessões
+    @st.cache_resource(show_spinner=False)
+    def _get_transformer_3857():
+        return Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+    
+    
+    def _coords_to_3857(coords):
+        # recebe todos os vértices (N, 2) de uma vez: uma chamada ao pyproj por camada
+        x_m, y_m = _get_transformer_3857().transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x_m, y_m])
+    
+    
+    try:
+        import orjson
+    except ImportError:  # opcional: sem orjson, cai no json da stdlib
+        orjson = None
+    
+    
+    def read_json(path: Path):
+        # orjson decodifica os GeoJSON (MBs) 2-3x mais rápido que o json da stdlib
+        if orjson is not None:
+            return orjson.loads(path.read_bytes())
         with path.open("r", encoding="utf-8") as f:
             return json.load(f)
     
     
-    def _is_index(x) -> bool:
-        return isinstance(x, Integral)
+    # Cache em disco do resultado do parse (shape + reprojeção + colunas), para o
+    # cold start não refazer tudo. O nome do arquivo leva o hash do conteúdo da
+    # fonte (não o mtime, que muda a cada clone/deploy): GeoJSON alterado -> chave
+    # nova e o pickle antigo é ignorado.
+    # A STRtree e o prepare não vão para o pickle (são refeitos, e são baratos).
+    INDEX_CACHE_DIR = Path(".cache")
+    INDEX_CACHE_VERSION = 3  # subir quando mudar o formato do que é salvo
+    
+    
+    def index_cache_file(path: Path, tag: str) -> Path:
+        h = hashlib.blake2b(digest_size=8)
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return INDEX_CACHE_DIR / f"{path.stem}.{tag}.v{INDEX_CACHE_VERSION}.{h.hexdigest()}.pkl"
     
     
-    def _tree_returns_indices(res) -> bool:
-        if res is None:
-            return False
+    def read_index_cache(cache_file: Path):
         try:
-            if len(res) == 0:
-                return True
-            return _is_index(res[0])
-        except Exception:
-            return False
+            with cache_file.open("rb") as f:
+                return pickle.load(f)
+        except Exception:  # ausente, truncado ou de outra versão: reconstrói
+            return None
     
     
-    @st.cache_resource(show_spinner=False)
-    def build_zone_index(zone_geojson: dict):
-        geoms, preps_list, props_list = [], [], []
-        for feat in (zone_geojson or {}).get("features") or []:
-            geom = feat.get("geometry")
+    def write_index_cache(cache_file: Path, data) -> None:
+        try:
+            INDEX_CACHE_DIR.mkdir(exist_ok=True)
+            tmp = cache_file.with_suffix(".tmp")
+            with tmp.open("wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp.replace(cache_file)
+        except OSError:  # disco só leitura (ex.: deploy): segue sem cache em disco
+            pass
+    
+    
+    def parse_zones(path: Path, keys: Tuple[str, ...]):
+        """
+        Zoneamento em uma passada só: parse do arquivo e, no mesmo loop por feature,
+        normaliza as properties (chaves do tooltip + cor de preenchimento) e monta
+        geometrias + sigla/nome já resolvidos (colunas paralelas a geoms).
+        O geojson devolvido (folium) leva a geometria simplificada; geoms fica com
+        a precisão original para o ponto-no-polígono.
+        """
+        zoneamento = read_json(path)
+    
+        geoms, siglas, nomes = [], [], []
+        colors: Dict[str, str] = {}  # siglas se repetem entre features: 1 cálculo por sigla
+        for feat in (zoneamento or {}).get("features") or []:
             props = feat.get("properties") or {}
+            feat["properties"] = props
+            # sigla/nome do cálculo saem das chaves originais (antes de dobrar aliases)
+            sigla = get_prop(props, ZONE_SIGLA_KEYS)
+            nome = get_prop(props, ZONE_NOME_KEYS)
+    
+            # tooltip: variantes (SIGLA, NOME...) preenchem a chave canônica vazia
+            for k in [k for k in props if k in ZONE_KEY_ALIASES]:
+                nk = ZONE_KEY_ALIASES[k]
+                if props.get(nk) in (None, "") and props[k] not in (None, ""):
+                    props[nk] = props[k]
+            for k in keys:
+                if k not in props or props[k] is None:
+                    props[k] = ""
+    
+            color = colors.get(sigla)
+            if color is None:
+                color = colors[sigla] = color_for_zone(sigla)
+            props["_fill_color"] = color
+    
+            geom = feat.get("geometry")
             if not geom:
                 continue
             try:
                 g = shape(geom)
-                geoms.append(g)
-                preps_list.append(prep(g))
-                props_list.append(props)
             except Exception:
                 continue
+            feat["geometry"] = mapping(g.simplify(ZONE_DISPLAY_SIMPLIFY_TOL, preserve_topology=True))
+            geoms.append(g)
+            siglas.append(sigla)
+            nomes.append(nome)
     
-        tree = STRtree(geoms) if geoms else None
-        geom_id_to_idx = {id(g): i for i, g in enumerate(geoms)}
-        return {"geoms": geoms, "preps": preps_list, "props": props_list, "tree": tree, "gid": geom_id_to_idx}
+        return zoneamento, geoms, siglas, nomes
     
     
-    def find_zone_for_click(zone_index, lat: float, lon: float):
+    @st.cache_resource(show_spinner=False, max_entries=1)
+    def load_and_index_zones(path: Path, mtime_ns: int, keys: Tuple[str, ...]):
+        """
+        Retorna (geojson normalizado para o folium, índice de zonas).
+        O clique só indexa as colunas sigla/nome do índice.
+        mtime_ns só entra na chave do cache: arquivo alterado -> recarrega sem restart
+        (max_entries=1: o índice da versão anterior sai da memória).
+        """
+        cache_file = index_cache_file(path, f"zonas-{zlib.crc32(repr(keys).encode('utf-8')):08x}")
+        parsed = read_index_cache(cache_file)
+        if parsed is None:
+            parsed = parse_zones(path, keys)
+            write_index_cache(cache_file, parsed)
+        zoneamento, geoms, siglas, nomes = parsed
+    
+        # array de geometrias preparadas in-place (o cache preparado fica na própria
+        # geometria): o teste ponto-no-polígono usa o índice interno de cada zona
+        geoms_arr = np.asarray(geoms, dtype=object)
+        shapely.prepare(geoms_arr)
+        tree = STRtree(geoms_arr, node_capacity=STRTREE_NODE_CAPACITY) if geoms else None
+        zone_index = {"geoms": geoms_arr, "siglas": siglas, "nomes": nomes, "tree": tree}
+        return zoneamento, zone_index
+    
+    
+    def find_zone_for_click(zone_index, p):
         tree = zone_index["tree"]
         if not tree:
             return None
     
-        p = Point(lon, lat)
-        candidates = tree.query(p)
-        geoms = zone_index["geoms"]
-        preps_list = zone_index["preps"]
-        props_list = zone_index["props"]
-        gid = zone_index["gid"]
-    
-        if _tree_returns_indices(candidates):
-            for i in candidates:
-                try:
-                    i = int(i)
-                    if preps_list[i].contains(p) or geoms[i].intersects(p):
-                        return props_list[i]
-                except Exception:
-                    continue
+        # árvore só filtra por bbox; o refinamento (ponto dentro/na borda) é uma
+        # chamada vetorizada sobre as zonas candidatas, que já estão preparadas
+        cand = tree.query(p)
+        if len(cand) == 0:
+            return None
+        hits = cand[shapely.intersects_xy(zone_index["geoms"][cand], p.x, p.y)]
+        if len(hits) == 0:
             return None
+        return int(hits.min())
     
-        for g in candidates:
-            i = gid.get(id(g))
-            if i is None:
-                continue
-            try:
-                if preps_list[i].contains(p) or geoms[i].intersects(p):
-                    return props_list[i]
-            except Exception:
-                continue
-        return None
     
+    def parse_ruas(path: Path):
+        """Ruas: parse + projeção para EPSG:3857 + nome/hierarquia resolvidos."""
+        ruas_geojson = read_json(path)
     
-    @st.cache_resource(show_spinner=False)
-    def build_ruas_index(ruas_geojson: dict):
-        geoms_m, props_list = [], []
+        geoms, nomes, hierarquias = [], [], []
         for feat in (ruas_geojson or {}).get("features") or []:
             geom = feat.get("geometry")
             props = feat.get("properties") or {}
             if not geom:
                 continue
             try:
-                g = shape(geom)
-                g_m = transform(_to_3857, g)
-                geoms_m.append(g_m)
-                props_list.append(props)
+                geoms.append(shape(geom))
             except Exception:
                 continue
+            nomes.append(get_prop(props, RUA_NOME_KEYS))
+            hierarquias.append(get_prop(props, RUA_HIERARQUIA_KEYS))
     
-        tree = STRtree(geoms_m) if geoms_m else None
-        geom_id_to_idx = {id(g): i for i, g in enumerate(geoms_m)}
-        return {"geoms_m": geoms_m, "props": props_list, "tree": tree, "gid": geom_id_to_idx}
+        geoms_m = list(shapely.transform(geoms, _coords_to_3857)) if geoms else []
+        return geoms_m, nomes, hierarquias
     
     
-    def find_nearest_street(ruas_index, lat: float, lon: float, max_dist_m: float = 120.0):
-        if not ruas_index or not ruas_index["tree"]:
-            return None
-    
-        p_m = transform(_to_3857, Point(lon, lat))
-        tree = ruas_index["tree"]
-        geoms_m = ruas_index["geoms_m"]
-        props_list = ruas_index["props"]
-        gid = ruas_index["gid"]
+    @st.cache_resource(show_spinner=False, max_entries=1)
+    def load_and_index_ruas(path: Path, mtime_ns: int):
+        """
+        Índice de ruas (EPSG:3857 + STRtree), com cache pela path
+        (o Streamlit não precisa hashear o GeoJSON inteiro a cada rerun).
+        mtime_ns só entra na chave do cache: arquivo alterado -> recarrega sem restart
+        (max_entries=1: o índice da versão anterior sai da memória).
+        """
+        cache_file = index_cache_file(path, "ruas")
+        parsed = read_index_cache(cache_file)
+        if parsed is None:
+            parsed = parse_ruas(path)
+            write_index_cache(cache_file, parsed)
+        geoms_m, nomes, hierarquias = parsed
     
-        try:
-            nearest = tree.nearest(p_m)
-            if nearest is None:
-                return None
+        tree = STRtree(geoms_m, node_capacity=STRTREE_NODE_CAPACITY) if geoms_m else None
+        return {"geoms_m": geoms_m, "nomes": nomes, "hierarquias": hierarquias, "tree": tree}
     
-            if _is_index(nearest):
-                i = int(nearest)
-                d = p_m.distance(geoms_m[i])
-                if d > max_dist_m:
-                    return None
-                return props_list[i]
     
-            g = nearest
-            d = p_m.distance(g)
-            if d > max_dist_m:
-                return None
-            i = gid.get(id(g))
-            if i is None:
-                return None
-            return props_list[i]
-        except Exception:
+    def find_nearest_street(ruas_index, p_m, max_dist_m: float = 120.0):
+        if not ruas_index or not ruas_index["tree"]:
             return None
     
+        # vizinho mais próximo + corte de distância numa chamada só ao GEOS
+        idxs = ruas_index["tree"].query_nearest(p_m, max_distance=max_dist_m)
+        if len(idxs) == 0:
+            return None
+        return int(idxs[0])
     
-    def compute_location(zone_index, ruas_index, lat: float, lon: float):
-        props_zone = find_zone_for_click(zone_index, lat, lon)
-        props_rua = find_nearest_street(ruas_index, lat, lon) if ruas_index else None
-    
-        zona_sigla = get_prop(props_zone or {}, "sigla", "SIGLA", "zona_sigla", "ZONA_SIGLA", "name")
-        zona_nome = get_prop(props_zone or {}, "zona", "ZONA", "nome", "NOME")
     
-        rua_nome = get_prop(props_rua or {}, "log_ofic", "LOG_OFIC", "name", "NOME")
-        hierarquia = get_prop(props_rua or {}, "hierarquia", "HIERARQUIA")
+    # índices com "_" ficam fora do hash do st.cache_data: a chave é o ponto + o
+    # mtime dos arquivos, para um GeoJSON trocado não responder com a zona/rua antiga
+    @st.cache_data(show_spinner=False, max_entries=1024)
+    def _locate_point(_zone_index, _ruas_index, zone_mtime_ns: int, ruas_mtime_ns: int, lat: float, lon: float):
+        # o ponto do clique é montado uma vez: WGS84 para as zonas e EPSG:3857
+        # para as ruas (que já estão projetadas no índice)
+        p = Point(lon, lat)
+        iz = find_zone_for_click(_zone_index, p)
+        ir = None
+        if _ruas_index:
+            x_m, y_m = _get_transformer_3857().transform(lon, lat)
+            ir = find_nearest_street(_ruas_index, Point(x_m, y_m))
     
         return {
-            "zona_sigla": zona_sigla,
-            "zona_nome": zona_nome,
-            "rua_nome": rua_nome,
-            "hierarquia": hierarquia,
-            "raw_zone": props_zone or {},
-            "raw_rua": props_rua or {},
+            "zona_sigla": _zone_index["siglas"][iz] if iz is not None else "",
+            "zona_nome": _zone_index["nomes"][iz] if iz is not None else "",
+            "rua_nome": _ruas_index["nomes"][ir] if ir is not None else "",
+            "hierarquia": _ruas_index["hierarquias"][ir] if ir is not None else "",
         }
     
     
+    def compute_location(zone_index, ruas_index, zone_mtime_ns: int, ruas_mtime_ns: int, lat: float, lon: float):
+        # 6 casas (~0,1 m): recalcular no mesmo ponto (trocando uso, esquina,
+        # geminação...) não refaz as consultas espaciais
+        return _locate_point(zone_index, ruas_index, zone_mtime_ns, ruas_mtime_ns, round(lat, 6), round(lon, 6))
+    
+    
     # =============================
     # Supabase queries
     # =============================
@@ -685,111 +760,177 @@ def main():
         return res.data or []
     
     
+    USE_CATEGORY_ORDER = ["Residencial", "Comercial", "Serviço", "Saúde/Educação", "Institucional", "Industrial", "Misto", "Sistema"]
+    
+    
+    # Ordem amigável: no Residencial, Unifamiliar antes de Multifamiliar (e o resto por label)
+    def _use_sort_key(cat: str, u: Dict[str, Any]):
+        code = (u.get("code") or "").upper()
+        label = (u.get("label") or "").lower()
+        if cat == "Residencial":
+            if code.startswith("RES_UNI") or "unifamiliar" in label or "casa" in label:
+                pri = 0
+            elif code.startswith("RES_MULTI") or "multifamiliar" in label:
+                pri = 1
+            else:
+                pri = 2
+            return (pri, label)
+        return (label,)
+    
+    
+    # Agrupamento da sidebar (categorias, opções por categoria, itens da busca)
+    # feito uma vez por carga da tabela, e não a cada rerun.
     @st.cache_data(show_spinner=False, ttl=300)
+    def sb_use_type_catalog():
+        use_types = sb_list_use_types()
+    
+        # fallback mínimo (se o banco estiver vazio)
+        if not use_types:
+            use_types = [
+                {"code": "RES_UNI", "label": "Residencial Unifamiliar (Casa)", "category": "Residencial"},
+                {"code": "RES_MULTI", "label": "Residencial Multifamiliar (Prédio)", "category": "Residencial"},
+            ]
+    
+        by_cat: Dict[str, list] = {}
+        for u in use_types:
+            by_cat.setdefault(u.get("category") or "Sistema", []).append(u)
+    
+        cats = sorted(by_cat, key=lambda c: (USE_CATEGORY_ORDER.index(c) if c in USE_CATEGORY_ORDER else 999, c))
+    
+        cat_options = {}
+        for c in cats:
+            in_cat = sorted(by_cat[c], key=lambda u, c=c: _use_sort_key(c, u))
+            cat_options[c] = {u["label"]: u["code"] for u in in_cat}
+    
+        search_map = {}
+        for u in use_types:
+            label = u.get("label") or u.get("code")
+            search_map[f"{u.get('category') or 'Sistema'}: {label}"] = (label, u.get("code"))
+        search_items = sorted(search_map, key=lambda x: x.lower())
+    
+        return cats, cat_options, search_items, search_map
+    
+    
+    SB_PAGE_SIZE = 1000  # teto padrão de linhas por resposta do PostgREST
+    
+    
+    def sb_fetch_all(table: str, columns: str, order_by: Tuple[str, ...]):
+        # ordem total (chaves + id como desempate: zone_rules repete (zona, uso)
+        # por subzona), senão o Postgres pode pular/duplicar linha entre páginas.
+        # O total (count="exact") vem na 1ª página: a carga para quando já tem
+        # tudo, sem página vazia extra e sem cortar se o max-rows for < SB_PAGE_SIZE
+        rows = []
+        total = None
+        while True:
+            first = not rows
+            q = sb.table(table).select(columns, count="exact" if first else None)
+            for col in (*order_by, "id"):
+                q = q.order(col)
+            res = q.range(len(rows), len(rows) + SB_PAGE_SIZE - 1).execute()
+            page = res.data or []
+            if first:
+                total = res.count
+            rows.extend(page)
+            # sem count (não devia acontecer): volta ao critério da página curta
+            done = (len(rows) >= total) if total is not None else (len(page) < SB_PAGE_SIZE)
+            if done or not page:
+                return rows
+    
+    
+    # Tabelas de referência (regras, estacionamento, sanitários) são pequenas:
+    # carregadas inteiras (renovadas pelo ttl) e consultadas em memória, sem
+    # round-trip por cálculo. As linhas são compartilhadas entre sessões: quem
+    # usa recebe cópia.
+    @st.cache_resource(show_spinner=False, ttl=300)
+    def sb_zone_rules_map() -> Dict[Tuple[str, str], Dict[str, Any]]:
+        # "*": a carga roda uma vez por ttl e não quebra em bases onde alguma
+        # coluna opcional (subzona, observacoes...) ainda não existe;
+        # compute_urbanism lê tudo com .get()
+        data = sb_fetch_all("zone_rules", "*", ("zone_sigla", "use_type_code"))
+        rules: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for r in data:
+            rules.setdefault((r.get("zone_sigla"), r.get("use_type_code")), r)
+        return rules
+    
+    
+    @st.cache_resource(show_spinner=False, ttl=300)
+    def sb_table_map(table: str, key: str, columns: str) -> Dict[str, Dict[str, Any]]:
+        rows: Dict[str, Dict[str, Any]] = {}
+        for r in sb_fetch_all(table, columns, (key,)):
+            rows.setdefault(r.get(key), r)  # 1ª linha por chave, como o antigo .limit(1)
+        return rows
+    
+    
+    def sb_lookup(table: str, key: str, columns: str, value: str) -> Optional[Dict[str, Any]]:
+        if not value:
+            return None
+        r = sb_table_map(table, key, columns).get(value)
+        return dict(r) if r else None
+    
+    
     def sb_get_zone_rule(zone_sigla: str, use_type_code: str) -> Optional[Dict[str, Any]]:
         if not zone_sigla or not use_type_code:
             return None
+        r = sb_zone_rules_map().get((zone_sigla, use_type_code))
+        return dict(r) if r else None
     
-        res = (
-            sb.table("zone_rules")
-            .select(
-                "zone_sigla,use_type_code,"
-                "to_max,tp_min,ia_min,ia_max,to_sub_max,"
-                "recuo_frontal_m,recuo_lateral_m,recuo_fundos_m,"
-                "gabarito_m,gabarito_pav,"
-                "area_min_lote_m2,area_max_lote_m2,"
-                "testada_min_meio_m,testada_min_esquina_m,testada_max_m,"
-                "allow_attach_one_side,notes,special_area_tag,"
-                "observacoes,source_ref,requires_subzone,subzone_code"
-            )
-            .eq("zone_sigla", zone_sigla)
-            .eq("use_type_code", use_type_code)
-            .limit(1)
-            .execute()
-        )
-        data = res.data or []
-        return data[0] if data else None
+    
+    # (tabela, coluna-chave, colunas)
+    PARKING_RULES = ("parking_rules", "use_type_code", "use_type_code,metric,value,min_vagas,source_ref,rule_json")
+    PARKING_RULES_V2 = ("parking_rules_v2", "use_code", "use_code,base_metric,rule_json,general_notes,source_ref,notes")
+    USE_SANITARY_PROFILE = ("use_sanitary_profile", "use_type_code", "use_type_code,sanitary_profile,notes")
+    SANITARY_PROFILES = ("sanitary_profiles", "sanitary_profile", "sanitary_profile,title,rule_json,source_ref,notes")
     
     
     # --- antigo (fallback) ---
-    @st.cache_data(show_spinner=False, ttl=300)
     def sb_get_parking_rule(use_type_code: str) -> Optional[Dict[str, Any]]:
-        if not use_type_code:
-            return None
-        res = (
-            sb.table("parking_rules")
-            .select("use_type_code,metric,value,min_vagas,source_ref,rule_json")
-            .eq("use_type_code", use_type_code)
-            .limit(1)
-            .execute()
-        )
-        data = res.data or []
-        return data[0] if data else None
+        return sb_lookup(*PARKING_RULES, use_type_code)
     
     
     # --- novo (Anexo IV) ---
-    @st.cache_data(show_spinner=False, ttl=300)
     def sb_get_parking_rule_v2(use_code: str) -> Optional[Dict[str, Any]]:
-        if not use_code:
-            return None
-        res = (
-            sb.table("parking_rules_v2")
-            .select("use_code,base_metric,rule_json,general_notes,source_ref,notes")
-            .eq("use_code", use_code)
-            .limit(1)
-            .execute()
-        )
-        data = res.data or []
-        return data[0] if data else None
+        return sb_lookup(*PARKING_RULES_V2, use_code)
     
     
     # --- Sanitários (Anexo III) ---
-    @st.cache_data(show_spinner=False, ttl=300)
     def sb_get_use_sanitary_profile(use_code: str) -> Optional[Dict[str, Any]]:
-        if not use_code:
-            return None
-        res = (
-            sb.table("use_sanitary_profile")
-            .select("use_type_code,sanitary_profile,notes")
-            .eq("use_type_code", use_code)
-            .limit(1)
-            .execute()
-        )
-        data = res.data or []
-        return data[0] if data else None
+        return sb_lookup(*USE_SANITARY_PROFILE, use_code)
     
     
-    @st.cache_data(show_spinner=False, ttl=300)
     def sb_get_sanitary_profile(profile_code: str) -> Optional[Dict[str, Any]]:
-        if not profile_code:
-            return None
-        res = (
-            sb.table("sanitary_profiles")
-            .select("sanitary_profile,title,rule_json,source_ref,notes")
-            .eq("sanitary_profile", profile_code)
-            .limit(1)
-            .execute()
-        )
-        data = res.data or []
-        return data[0] if data else None
+        return sb_lookup(*SANITARY_PROFILES, profile_code)
+    
+    
+    # A cada run: (re)carrega as tabelas de referência em paralelo (round-trips
+    # independentes -> tempo do mais lento, não a soma). Com o cache quente são só
+    # leituras em memória; quando o ttl expira, a recarga acontece aqui e não em
+    # série dentro do Gerar Estudo. Tabela com erro não derruba a página: o erro
+    # só aparece se o cálculo precisar dela.
+    run_parallel(
+        (sb_list_use_types,),
+        (sb_zone_rules_map,),
+        *((sb_table_map, *spec) for spec in (PARKING_RULES, PARKING_RULES_V2, USE_SANITARY_PROFILE, SANITARY_PROFILES)),
+    )
     
     
     # =============================
     # Cálculos urbanísticos (seu motor atual)
     # =============================
-    def estimate_pavimentos(gabarito_pav: Optional[int], gabarito_m: Optional[float]) -> Optional[int]:
-        try:
-            if gabarito_pav not in (None, "", 0):
-                return int(gabarito_pav)
-        except Exception:
-            pass
+    ALTURA_PAV_ESTIMADA_M = 3.0  # pé-direito médio para converter gabarito (m) em pavimentos
     
+    def estimate_pavimentos(gabarito_pav: Optional[int], gabarito_m: Optional[float]) -> Optional[int]:
+        # o Supabase pode devolver texto ("2", "9.0"): passa por float() antes do
+        # int(); valor inválido, NaN ou infinito cai no próximo critério / None
+        if gabarito_pav not in (None, "", 0):
+            try:
+                return int(float(gabarito_pav))
+            except (TypeError, ValueError, OverflowError):
+                pass
+        if gabarito_m is None:
+            return None
         try:
-            if gabarito_m is None:
-                return None
-            pav = int(float(gabarito_m) // 3.0)
-            return max(pav, 1) if pav > 0 else 1
-        except Exception:
+            return max(int(float(gabarito_m) / ALTURA_PAV_ESTIMADA_M), 1)
+        except (TypeError, ValueError, OverflowError):
             return None
     
     
@@ -807,20 +948,25 @@ def main():
         qtd_unidades: Optional[int] = None,
         area_unidade_m2: Optional[float] = None,
     ) -> Dict[str, Any]:
-        area_lote = float(testada) * float(profundidade)
+        # conversões uma vez só; daqui pra baixo tudo já é float/bool
+        testada = float(testada)
+        profundidade = float(profundidade)
+        esquina = bool(esquina)
+        corner_two_fronts = bool(corner_two_fronts)
+        attach_one_side = bool(attach_one_side)
+        area_lote = testada * profundidade
     
         calc: Dict[str, Any] = {
             "use_label": use_label,
             "use_code": use_code,
             "zona_sigla": zone_sigla,
-            "testada": float(testada),
-            "profundidade": float(profundidade),
-            "esquina": bool(esquina),
-            "corner_two_fronts": bool(corner_two_fronts),
-            "attach_one_side": bool(attach_one_side),
+            "testada": testada,
+            "profundidade": profundidade,
+            "esquina": esquina,
+            "corner_two_fronts": corner_two_fronts,
+            "attach_one_side": attach_one_side,
             "area_lote": area_lote,
             "rule": rule,
-            "park": park,
             "qtd_unidades": qtd_unidades,
             "area_unidade_m2": area_unidade_m2,
         }
@@ -845,10 +991,8 @@ def main():
             calc["ia_max"] = ia_max
             calc["to_sub_max"] = to_sub_max
     
-            calc["area_max_ocupacao_to"] = (float(to_max) * area_lote) if to_max is not None else None
-            calc["area_min_permeavel"] = (float(tp_min) * area_lote) if tp_min is not None else None
-            calc["area_max_total_construida"] = (float(ia_max) * area_lote) if ia_max is not None else None
-            calc["area_max_subsolo"] = (float(to_sub_max) * area_lote) if to_sub_max not in (None, "") else None
+            # contas de área/envelope (só números da regra + lote): core/urban_calc.py
+            calc.update(urbanism_math(rule, testada, profundidade, esquina, corner_two_fronts, attach_one_side))
     
             calc["recuo_frontal_m"] = rec_fr
             calc["recuo_lateral_m"] = rec_lat
@@ -873,33 +1017,16 @@ def main():
             calc["observacoes"] = rule.get("observacoes")
             calc["source_ref"] = rule.get("source_ref")
     
-            if rec_lat is not None and rec_fr is not None and rec_fun is not None:
-                env = envelope_area(
-                    testada=testada,
-                    profundidade=profundidade,
-                    rec_fr=float(rec_fr),
-                    rec_fun=float(rec_fun),
-                    rec_lat=float(rec_lat),
-                    esquina=bool(esquina),
-                    corner_two_fronts=bool(corner_two_fronts),
-                    attach_one_side=bool(attach_one_side),
-                )
-                calc["largura_util_miolo"] = env["largura_util"]
-                calc["prof_util_miolo"] = env["prof_util"]
-                calc["area_miolo"] = env["area_miolo"]
-                calc["esquina_modelo"] = env.get("esquina_modelo")
-            else:
-                calc["largura_util_miolo"] = None
-                calc["prof_util_miolo"] = None
-                calc["area_miolo"] = None
-                calc["esquina_modelo"] = None
-    
-            area_to = calc.get("area_max_ocupacao_to")
-            area_miolo = calc.get("area_miolo")
-            if area_to is not None and area_miolo is not None:
-                calc["area_max_ocupacao_real"] = min(float(area_to), float(area_miolo))
+            area_to = calc["area_max_ocupacao_to"]
+            if calc["area_miolo"] is not None:
+                rec_fr, rec_lat, rec_fun = float(rec_fr), float(rec_lat), float(rec_fun)
+                env = {
+                    "largura_util": calc["largura_util_miolo"],
+                    "prof_util": calc["prof_util_miolo"],
+                    "area_miolo": calc["area_miolo"],
+                }
             else:
-                calc["area_max_ocupacao_real"] = area_to if area_to is not None else area_miolo
+                env = None
             # =============================
             # Opções de implantação (Relatório - Unifamiliar)
             # Opção 1: recuos padrão da zona (com a geometria do lote)
@@ -908,63 +1035,48 @@ def main():
             # =============================
             if use_code == "res_unifamiliar":
                 try:
-                    # Opção 1 (padrão)
-                    env_padrao = envelope_area(
-                        testada=testada,
-                        profundidade=profundidade,
-                        rec_fr=float(rec_fr),
-                        rec_fun=float(rec_fun),
-                        rec_lat=float(rec_lat),
-                        esquina=bool(esquina),
-                        corner_two_fronts=bool(corner_two_fronts),
-                        attach_one_side=bool(attach_one_side),
-                    )
-                    area_max_padrao = None
-                    if area_to is not None and env_padrao.get("area_miolo") is not None:
-                        area_max_padrao = min(float(area_to), float(env_padrao["area_miolo"]))
-                    elif env_padrao.get("area_miolo") is not None:
-                        area_max_padrao = float(env_padrao["area_miolo"])
+                    # Opção 1 (padrão): mesmos argumentos do envelope acima -> reaproveita
+                    if env is None:
+                        raise ValueError("recuos da zona não cadastrados")
+                    env_padrao = env
+                    area_max_padrao = min(area_to, env_padrao["area_miolo"]) if area_to is not None else env_padrao["area_miolo"]
 
                     # Opção 2 (Art. 112) — zera frente e laterais
                     env_art112 = envelope_area(
                         testada=testada,
                         profundidade=profundidade,
                         rec_fr=0.0,
-                        rec_fun=float(rec_fun),
+                        rec_fun=rec_fun,
                         rec_lat=0.0,
-                        esquina=bool(esquina),
-                        corner_two_fronts=bool(corner_two_fronts),
+                        esquina=esquina,
+                        corner_two_fronts=corner_two_fronts,
                         attach_one_side=False,  # já está "colado" em ambas as laterais
                     )
-                    area_max_art112 = None
-                    if area_to is not None and env_art112.get("area_miolo") is not None:
-                        area_max_art112 = min(float(area_to), float(env_art112["area_miolo"]))
-                    elif env_art112.get("area_miolo") is not None:
-                        area_max_art112 = float(env_art112["area_miolo"])
+                    area_max_art112 = min(area_to, env_art112["area_miolo"]) if area_to is not None else env_art112["area_miolo"]
 
                     calc["opcao_1_recuos_padrao"] = {
                         "nome": "Recuos padrão da zona",
                         "base_legal": "Recuos da zona (padrão)",
-                        "recuo_frontal_m": float(rec_fr),
-                        "recuo_lateral_m": float(rec_lat),
-                        "recuo_fundo_m": float(rec_fun),
-                        "largura_util_m": float(env_padrao.get("largura_util") or 0.0),
-                        "profundidade_util_m": float(env_padrao.get("prof_util") or 0.0),
-                        "area_envelope_m2": float(env_padrao.get("area_miolo") or 0.0),
-                        "area_max_terreo_m2": float(area_max_padrao or 0.0),
-                        "limitante": "TO" if (area_to is not None and area_max_padrao is not None and float(area_to) <= float(env_padrao.get("area_miolo") or 0.0)) else "Recuos",
+                        "recuo_frontal_m": rec_fr,
+                        "recuo_lateral_m": rec_lat,
+                        "recuo_fundo_m": rec_fun,
+                        "largura_util_m": env_padrao["largura_util"],
+                        "profundidade_util_m": env_padrao["prof_util"],
+                        "area_envelope_m2": env_padrao["area_miolo"],
+                        "area_max_terreo_m2": area_max_padrao,
+                        "limitante": "TO" if (area_to is not None and area_to <= env_padrao["area_miolo"]) else "Recuos",
                     }
                     calc["opcao_2_art112_sem_recuos_frente_laterais"] = {
                         "nome": "Art. 112 (flexibilidade) — sem recuos de frente e laterais",
                         "base_legal": "LC 90/2023 — Art. 112 (Unifamiliar)",
                         "recuo_frontal_m": 0.0,
                         "recuo_lateral_m": 0.0,
-                        "recuo_fundo_m": float(rec_fun),
-                        "largura_util_m": float(env_art112.get("largura_util") or 0.0),
-                        "profundidade_util_m": float(env_art112.get("prof_util") or 0.0),
-                        "area_envelope_m2": float(env_art112.get("area_miolo") or 0.0),
-                        "area_max_terreo_m2": float(area_max_art112 or 0.0),
-                        "limitante": "TO" if (area_to is not None and area_max_art112 is not None and float(area_to) <= float(env_art112.get("area_miolo") or 0.0)) else "Recuo de fundo",
+                        "recuo_fundo_m": rec_fun,
+                        "largura_util_m": env_art112["largura_util"],
+                        "profundidade_util_m": env_art112["prof_util"],
+                        "area_envelope_m2": env_art112["area_miolo"],
+                        "area_max_terreo_m2": area_max_art112,
+                        "limitante": "TO" if (area_to is not None and area_to <= env_art112["area_miolo"]) else "Recuo de fundo",
                         "observacao": "Pode zerar recuos de frente e laterais, desde que mantenha TO (máx) e TP (mín) da zona.",
                     }
                 except Exception:
@@ -994,24 +1106,28 @@ def main():
             min_v = park.get("min_vagas")
             rule_json = park.get("rule_json") or {}
     
+            # números da regra convertidos uma vez (o Supabase pode devolver texto)
+            try:
+                value_f = float(value)
+            except (TypeError, ValueError):
+                value_f = None
+            try:
+                min_i = int(min_v) if min_v is not None else None
+            except (TypeError, ValueError):
+                min_i = None
+    
             if metric == "fixed":
-                try:
-                    vagas = int(value)
-                except Exception:
-                    vagas = None
+                vagas = int(value_f) if value_f is not None else None
     
             elif metric == "per_unit":
-                try:
-                    vagas = max(int(value), int(min_v or 0))
-                except Exception:
-                    vagas = None
+                vagas = max(int(value_f), min_i or 0) if value_f is not None else None
     
             elif metric == "per_area":
-                try:
-                    vagas = int((area_lote * float(value)) // 1)
-                    if min_v is not None:
-                        vagas = max(vagas, int(min_v))
-                except Exception:
+                if value_f is not None:
+                    vagas = int(area_lote * value_f)  # área e taxa >= 0: int() já trunca
+                    if min_i is not None:
+                        vagas = max(vagas, min_i)
+                else:
                     vagas = None
     
             elif metric == "json_rule":
@@ -1045,8 +1161,8 @@ def main():
                             else:
                                 vagas = int(round(raw))
     
-                            if min_v is not None:
-                                vagas = max(vagas, int(min_v))
+                            if min_i is not None:
+                                vagas = max(vagas, min_i)
                         except Exception:
                             vagas = None
     
@@ -1194,14 +1310,11 @@ def main():
         st.error(f"Arquivo não encontrado: {ZONE_FILE}")
         st.stop()
     
-    zoneamento_raw = load_geojson(ZONE_FILE)
-    ruas_raw = load_geojson(RUAS_FILE) if RUAS_FILE.exists() else None
-    
-    zone_fields = ("sigla", "zona", "zona_sigla", "nome", "NOME", "SIGLA", "name")
-    zoneamento = ensure_properties_keys(zoneamento_raw, zone_fields)
+    zone_mtime_ns = ZONE_FILE.stat().st_mtime_ns
+    zoneamento, zone_index = load_and_index_zones(ZONE_FILE, zone_mtime_ns, ZONE_TOOLTIP_FIELDS)
     
-    zone_index = build_zone_index(zoneamento)
-    ruas_index = build_ruas_index(ruas_raw) if ruas_raw else None
+    ruas_mtime_ns = RUAS_FILE.stat().st_mtime_ns if RUAS_FILE.exists() else 0
+    ruas_index = load_and_index_ruas(RUAS_FILE, ruas_mtime_ns) if RUAS_FILE.exists() else None
     
     
     # =============================
@@ -1220,60 +1333,19 @@ def main():
     # =============================
     # Sidebar (Categoria + Busca Direta)
     # =============================
-    use_types = sb_list_use_types()
-    
-    # fallback mínimo (se o banco estiver vazio)
-    if not use_types:
-        use_types = [
-            {"code": "RES_UNI", "label": "Residencial Unifamiliar (Casa)", "category": "Residencial"},
-            {"code": "RES_MULTI", "label": "Residencial Multifamiliar (Prédio)", "category": "Residencial"},
-        ]
-    
-    preferred_order = ["Residencial", "Comercial", "Serviço", "Saúde/Educação", "Institucional", "Industrial", "Misto", "Sistema"]
-    cats = sorted({(u.get("category") or "Sistema") for u in use_types}, key=lambda c: (preferred_order.index(c) if c in preferred_order else 999, c))
+    cats, options_by_cat, search_items, search_map = sb_use_type_catalog()
     
     st.sidebar.markdown("<div class='sidebar-section'><b>📋 1. Escolha o Uso</b></div>", unsafe_allow_html=True)
     
     cat_selected = st.sidebar.selectbox("Categoria:", cats, index=(cats.index("Residencial") if "Residencial" in cats else 0))
     
-    in_cat = [u for u in use_types if (u.get("category") or "Sistema") == cat_selected]
-    
-    # Ordem amigável: no Residencial, Unifamiliar antes de Multifamiliar (e o resto por label)
-    def _cat_sort_key(u: Dict[str, Any]):
-        code = (u.get("code") or "").upper()
-        label = (u.get("label") or "").lower()
-        if cat_selected == "Residencial":
-            if code.startswith("RES_UNI") or "unifamiliar" in label or "casa" in label:
-                pri = 0
-            elif code.startswith("RES_MULTI") or "multifamiliar" in label:
-                pri = 1
-            else:
-                pri = 2
-            return (pri, label)
-        return (label,)
-    
-    in_cat = sorted(in_cat, key=_cat_sort_key)
-    
-    cat_options = {u["label"]: u["code"] for u in in_cat}
-    if not cat_options:
-        cat_options = {"Genérico (fallback) • Sistema": "SYS_FALLBACK"}
+    cat_options = options_by_cat.get(cat_selected) or {"Genérico (fallback) • Sistema": "SYS_FALLBACK"}
     
     use_label_cat = st.sidebar.selectbox("Opções na Categoria:", list(cat_options.keys()))
     use_code_cat = cat_options[use_label_cat]
     
     st.sidebar.markdown("<div class='sidebar-section' style='margin-top:10px;'><b>🔎 2. Busca Direta</b></div>", unsafe_allow_html=True)
     
-    search_items = []
-    search_map = {}
-    for u in use_types:
-        c = (u.get("category") or "Sistema")
-        label = u.get("label") or u.get("code")
-        k = f"{c}: {label}"
-        search_items.append(k)
-        search_map[k] = (label, u.get("code"))
-    
-    search_items = sorted(search_items, key=lambda x: x.lower())
-    
     search_pick = st.sidebar.selectbox("Ou digite para pesquisar:", ["—"] + search_items)
     use_search = st.sidebar.checkbox("Usar seleção da Busca Direta", value=False)
     
@@ -1284,6 +1356,10 @@ def main():
         use_label, use_code = use_label_cat, use_code_cat
         use_category = cat_selected
     
+    # dump bruto (res + regra) só para quem mantém o app: liga por secret/env
+    # DEBUG, nunca por widget na tela pública
+    show_debug = str(st.secrets.get("DEBUG") or os.getenv("DEBUG") or "").lower() in ("1", "true", "yes")
+    
     
     # =============================
     # Layout (Mapa + Painel)
@@ -1291,16 +1367,42 @@ def main():
     col_map, col_panel = st.columns([3, 1], gap="large")
     
     with col_map:
-        m = folium.Map(location=[-3.69, -40.35], zoom_start=13, tiles="OpenStreetMap")
+        import folium
+        from streamlit_folium import st_folium
+    
+        # O GeoJSON já vem parseado do cache (load_and_index_zones); o Map em si é
+        # montado a cada run. Não pode ser cache_resource: o st_folium faz
+        # feature_group_to_add.add_to(map), e num Map compartilhado o marcador/popup
+        # de uma sessão ficaria gravado no mapa de todas as outras.
+        def build_base_map(zoneamento):
+            m = folium.Map(location=MAP_CENTER, zoom_start=MAP_ZOOM, tiles="OpenStreetMap")
+            folium.GeoJson(
+                zoneamento,
+                name="Zoneamento",
+                style_function=zone_style,
+                highlight_function=lambda x: {"weight": 3, "color": "#000000", "fillOpacity": 0.40},
+                tooltip=folium.GeoJsonTooltip(
+                    fields=list(ZONE_TOOLTIP_FIELDS),
+                    aliases=list(ZONE_TOOLTIP_ALIASES),
+                    sticky=True,
+                    labels=True,
+                ),
+            ).add_to(m)
+            return m
     
-        zone_aliases = ["Sigla: ", "Zona: ", "Sigla Zona: ", "Nome: ", "Nome: ", "Sigla: ", "Nome: "]
-        folium.GeoJson(
-            zoneamento,
-            name="Zoneamento",
-            style_function=zone_style,
-            highlight_function=lambda x: {"weight": 3, "color": "#000000", "fillOpacity": 0.40},
-            tooltip=folium.GeoJsonTooltip(fields=list(zone_fields), aliases=zone_aliases, sticky=True, labels=True),
-        ).add_to(m)
+        # O clique no mapa já dispara um rerun; o valor do componente fica em
+        # session_state["main_map"] antes do st_folium rodar, então o ponto novo é
+        # aplicado aqui mesmo e o marcador sai nesta passada (sem st.rerun()).
+        last = (st.session_state.get("main_map") or {}).get("last_clicked")
+        if last:
+            new_click = {"lat": float(last["lat"]), "lng": float(last["lng"])}
+            if st.session_state["click"] != new_click:
+                st.session_state["click"] = new_click
+                st.session_state["res"] = None
+                st.session_state["calc"] = None
+    
+        fg = folium.FeatureGroup(name="Ponto selecionado")
+        center, zoom = MAP_CENTER, MAP_ZOOM
     
         click = st.session_state["click"]
         if click:
@@ -1312,29 +1414,31 @@ def main():
                 tooltip="Ponto selecionado",
                 popup=folium.Popup(html, max_width=420, show=True),
                 icon=folium.Icon(color="blue", icon="info-sign"),
-            ).add_to(m)
-            m.location = [lat, lon]
-            m.zoom_start = 16
-    
-        out = st_folium(m, width=1200, height=700, key="main_map")
-    
-        last = (out or {}).get("last_clicked")
-        if last:
-            new_click = {"lat": float(last["lat"]), "lng": float(last["lng"])}
-            if st.session_state["click"] != new_click:
-                st.session_state["click"] = new_click
-                st.session_state["res"] = None
-                st.session_state["calc"] = None
-                st.rerun()
+            ).add_to(fg)
+            center, zoom = [lat, lon], 16
+    
+        st_folium(
+            build_base_map(zoneamento),
+            width=1200,
+            height=700,
+            key="main_map",
+            feature_group_to_add=fg,
+            center=center,
+            zoom=zoom,
+        )
     
     
-    with col_panel:
+    # Painel em fragment: mexer nos campos reroda só o painel (o mapa e os
+    # resultados ficam como estão). Gerar Estudo chama st.rerun() de app inteiro,
+    # que atualiza o popup do mapa e os resultados.
+    @st.fragment
+    def render_panel():
         st.subheader("Selecione o lote no mapa")
     
         click = st.session_state["click"]
         if not click:
             st.info("Clique no mapa para marcar um ponto.")
-            st.stop()
+            return
     
         lat = float(click["lat"])
         lon = float(click["lng"])
@@ -1495,18 +1599,16 @@ def main():
     
         if st.button("🚀 GERAR ESTUDO DE VIABILIDADE", use_container_width=True):
             with st.spinner("Calculando..."):
-                res = compute_location(zone_index, ruas_index, lat, lon)
+                res = compute_location(zone_index, ruas_index, zone_mtime_ns, ruas_mtime_ns, lat, lon)
                 st.session_state["res"] = res
     
                 zona_sigla = res.get("zona_sigla") or ""
-                rule = sb_get_zone_rule(zona_sigla, use_code)
-                st.write("DEBUG:", rule)
     
-                # estacionamento: v2 + fallback antigo
+                # regra da zona + estacionamento (v2 + fallback antigo) + sanitários:
+                # lookups nas tabelas de referência já carregadas
+                rule = sb_get_zone_rule(zona_sigla, use_code)
                 park_v2 = sb_get_parking_rule_v2(use_code)
                 park_old = sb_get_parking_rule(use_code)
-    
-                # sanitários
                 use_prof = sb_get_use_sanitary_profile(use_code)
                 san_prof = sb_get_sanitary_profile((use_prof or {}).get("sanitary_profile"))
     
@@ -1581,11 +1683,9 @@ def main():
                 if park_v2 and (park_v2.get("rule_json") or {}).get("use_code"):
                     pv2 = calc_parking_v2(park_v2["rule_json"], parking_inputs)
                     calc["parking_v2"] = pv2
-                    calc["parking_v2_rule_json"] = park_v2["rule_json"]
                     calc["parking_v2_source_ref"] = park_v2.get("source_ref")
                 else:
                     calc["parking_v2"] = None
-                    calc["parking_v2_rule_json"] = None
                     calc["parking_v2_source_ref"] = None
     
                 if san_prof and san_prof.get("rule_json") and float(effective_area_util or 0) > 0:
@@ -1606,6 +1706,9 @@ def main():
     
         st.caption("💡 Dica: o pin aparece na hora. O cálculo acontece só quando você clicar em Gerar Estudo.")
     
+    with col_panel:
+        render_panel()
+    
     
     # =============================
     # RESULTADOS
@@ -1620,58 +1723,59 @@ def main():
         st.caption("Clique no mapa, preencha os dados e depois clique em **Gerar Estudo**.")
         st.stop()
     
-    c1, c2, c3 = st.columns(3)
+    # res só existe com ponto marcado (novo clique zera res/calc)
+    lat = float(st.session_state["click"]["lat"])
+    lon = float(st.session_state["click"]["lng"])
     
-    with c1:
-        st.markdown(
-            f"""
-            <div class="card">
-              <div class="pill">📍 Localização</div>
-              <div class="muted">Coordenadas</div>
-              <div class="big">{lat:.6f}, {lon:.6f}</div>
-              <div class="muted" style="margin-top:10px;">Zona</div>
-              <div class="big">{res.get("zona_nome") or "—"}</div>
-              <div class="muted" style="margin-top:10px;">Sigla</div>
-              <div class="big">{res.get("zona_sigla") or "—"}</div>
-            </div>
-            """,
-            unsafe_allow_html=True,
-        )
+    # campos do calc usados várias vezes no render: lidos uma vez só
+    use_code_r = calc.get("use_code") or ""
+    use_label_r = calc.get("use_label") or ""
+    zona_sigla_r = calc.get("zona_sigla")
+    area_lote = calc.get("area_lote")
+    esquina_r = calc.get("esquina")
+    rule = calc.get("rule")
     
-    with c2:
-        st.markdown(
-            f"""
-            <div class="card">
-              <div class="pill">🛣️ Via</div>
-              <div class="muted">Rua</div>
-              <div class="big">{res.get("rua_nome") or "—"}</div>
-              <div class="muted" style="margin-top:10px;">Hierarquia</div>
-              <div class="big">{res.get("hierarquia") or "—"}</div>
-            </div>
-            """,
-            unsafe_allow_html=True,
-        )
+    # 3 cards numa única emissão (grid CSS no lugar de st.columns): 1 mensagem pro frontend
+    st.markdown(
+        f"""
+        <div class="grid3">
+          <div class="card">
+            <div class="pill">📍 Localização</div>
+            <div class="muted">Coordenadas</div>
+            <div class="big">{lat:.6f}, {lon:.6f}</div>
+            <div class="muted" style="margin-top:10px;">Zona</div>
+            <div class="big">{res.get("zona_nome") or "—"}</div>
+            <div class="muted" style="margin-top:10px;">Sigla</div>
+            <div class="big">{res.get("zona_sigla") or "—"}</div>
+          </div>
+          <div class="card">
+            <div class="pill">🛣️ Via</div>
+            <div class="muted">Rua</div>
+            <div class="big">{res.get("rua_nome") or "—"}</div>
+            <div class="muted" style="margin-top:10px;">Hierarquia</div>
+            <div class="big">{res.get("hierarquia") or "—"}</div>
+          </div>
+          <div class="card">
+            <div class="pill">🏡 Lote / Uso</div>
+            <div class="muted">Uso</div>
+            <div class="big">{use_label_r}</div>
+            <div class="muted" style="margin-top:10px;">Área do lote</div>
+            <div class="big">{fmt_m2(area_lote)}</div>
+            <div class="muted" style="margin-top:10px;">Esquina</div>
+            <div class="big">{"Sim" if esquina_r else "Não"}</div>
+          </div>
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
     
-    with c3:
-        area_lote = calc.get("area_lote")
-        st.markdown(
-            f"""
-            <div class="card">
-              <div class="pill">🏡 Lote / Uso</div>
-              <div class="muted">Uso</div>
-              <div class="big">{calc.get("use_label")}</div>
-              <div class="muted" style="margin-top:10px;">Área do lote</div>
-              <div class="big">{fmt_m2(area_lote)}</div>
-              <div class="muted" style="margin-top:10px;">Esquina</div>
-              <div class="big">{"Sim" if calc.get("esquina") else "Não"}</div>
-            </div>
-            """,
-            unsafe_allow_html=True,
-        )
+    # só serializa/envia o bruto quando pedido (antes ia um st.write a cada cálculo)
+    if show_debug:
+        with st.expander("Debug (raw)"):
+            st.code(json.dumps({"res": res, "rule": rule}, ensure_ascii=False, indent=2, default=str), language="json")
     
-    rule = calc.get("rule")
     if not rule:
-        st.warning(f"Sem regra cadastrada no Supabase para **{calc.get('zona_sigla')} + {calc.get('use_code')}**.")
+        st.warning(f"Sem regra cadastrada no Supabase para **{zona_sigla_r} + {use_code_r}**.")
         st.caption("Cadastre em `zone_rules` e tente novamente.")
         st.stop()
     
@@ -1679,8 +1783,6 @@ def main():
     # Viabilidade “para leigo” (Uni e Multi)
     # FIX: renderiza sempre que for residencial; se sim não existir, recalcula com inputs salvos.
     # =============================
-    use_code_r = calc.get("use_code") or ""
-    use_label_r = calc.get("use_label") or ""
     use_cat_r = calc.get("use_category") or use_category if "use_category" in globals() else ""
     
     if is_res_any(use_code_r, use_label_r, use_cat_r):
@@ -1710,12 +1812,13 @@ def main():
     checks = sim.get("checks") or {}
     
     # Vagas (prioriza v2)
-    pv2 = calc.get("parking_v2")
+    pv2_required = (calc.get("parking_v2") or {}).get("required")
+    vagas_min = calc.get("vagas_min")
     vagas_txt = "—"
-    if pv2 and pv2.get("required") is not None:
-        vagas_txt = str(int(pv2.get("required")))
-    elif calc.get("vagas_min") is not None:
-        vagas_txt = str(int(calc.get("vagas_min")))
+    if pv2_required is not None:
+        vagas_txt = str(int(pv2_required))
+    elif vagas_min is not None:
+        vagas_txt = str(int(vagas_min))
     
     # Sanitários (totais)
     san = calc.get("sanitary") or {}
@@ -1732,14 +1835,13 @@ def main():
     # Percentuais úteis
     to_real_pct = sim.get("to_real_pct")
     to_proj_pct = sim.get("to_proj_pct")
+    footprint_proj_m2 = sim.get("footprint_proj_m2")
+    total_used_m2 = sim.get("total_used_m2")
     
-    # Status (Unifamiliar)
-    if is_res_uni(calc.get("use_code"), calc.get("use_label")):
+    # Status (Unifamiliar) — vai no mesmo st.markdown do resumo, logo abaixo
+    if is_res_uni(use_code_r, use_label_r):
         if mode == "auto_limits":
-            st.markdown(
-                "<div class='ok'><b>✅ Uso permitido na zona</b><br/>Abaixo estão os limites máximos do lote (modo automático).</div>",
-                unsafe_allow_html=True,
-            )
+            status_html = "<div class='ok'><b>✅ Uso permitido na zona</b><br/>Abaixo estão os limites máximos do lote (modo automático).</div>"
         else:
             viable = bool(sim.get("viable"))
             status_html = (
@@ -1747,7 +1849,6 @@ def main():
                 if viable
                 else "<div class='warn'><b>⚠️ Seu projeto ultrapassa algum limite</b><br/>Verifique TO (térreo) e/ou IA (total).</div>"
             )
-            st.markdown(status_html, unsafe_allow_html=True)
     
         # Conteúdo (Unifamiliar) – texto bem leigo
         to_real_m2 = lim.get("area_max_ocup_real_m2")
@@ -1761,13 +1862,15 @@ def main():
             header_terreo = "No térreo você pode ocupar até"
             header_terreo_pct = "Isso corresponde a uma ocupação (TO real) de"
         else:
-            terreo_m2 = sim.get("footprint_proj_m2")
+            terreo_m2 = footprint_proj_m2
             terreo_pct = to_proj_pct
             header_terreo = "Seu projeto ocupa no térreo (aprox.)"
             header_terreo_pct = "Isso corresponde a uma ocupação (TO do projeto) de"
     
+        # status + resumo numa emissão só
         st.markdown(
             f"""
+            {status_html}
             <div class="card" style="margin-top:10px;">
               <h4>Resumo rápido</h4>
     
@@ -1792,7 +1895,7 @@ def main():
               <div class="big">{int(sim.get("pavimentos_usados") or 1)} pav</div>
     
               <div class="muted" style="margin-top:8px;">Área total usada na conta</div>
-              <div class="big">{fmt_m2(sim.get("total_used_m2"))} <span class="muted">({sim.get("total_mode")})</span></div>
+              <div class="big">{fmt_m2(total_used_m2)} <span class="muted">({sim.get("total_mode")})</span></div>
     
               <div class="muted" style="margin-top:8px;">Área útil (vagas/sanitários)</div>
               <div class="big">{fmt_m2(sim.get("area_util_m2"))} <span class="muted">({sim.get("area_util_mode")})</span></div>
@@ -1814,15 +1917,15 @@ def main():
             with st.expander("Detalhes da checagem (TO / IA)"):
                 # TO
                 if checks.get("has_to"):
-                    st.write(f"- TO (térreo): {fmt_m2(sim.get('footprint_proj_m2'))} (projeto) vs {fmt_m2(lim.get('area_max_ocup_real_m2'))} (máximo c/ recuos) → " +
-                             ("✅ ok" if checks.get("ok_to") else "⚠️ excede"))
+                    ok_to_txt = "✅ ok" if checks.get("ok_to") else "⚠️ excede"
+                    st.write(f"- TO (térreo): {fmt_m2(footprint_proj_m2)} (projeto) vs {fmt_m2(to_real_m2)} (máximo c/ recuos) → {ok_to_txt}")
                 else:
                     st.write("- TO: **sem dados suficientes** (TO/recuos não cadastrados).")
     
                 # IA
                 if checks.get("has_ia"):
-                    st.write(f"- IA (total): {fmt_m2(sim.get('total_used_m2'))} (projeto) vs {fmt_m2(lim.get('area_max_total_construida_m2'))} (máximo) → " +
-                             ("✅ ok" if checks.get("ok_ia") else "⚠️ excede"))
+                    ok_ia_txt = "✅ ok" if checks.get("ok_ia") else "⚠️ excede"
+                    st.write(f"- IA (total): {fmt_m2(total_used_m2)} (projeto) vs {fmt_m2(ia_max_m2)} (máximo) → {ok_ia_txt}")
                 else:
                     st.write("- IA: **sem dados suficientes** (IA máximo não cadastrado).")
     
@@ -9,6 +9,7 @@ Inclui:
 
 from __future__ import annotations
 
+from textwrap import dedent
 from typing import Any, Dict, Optional
 
 import streamlit as st
@@ -90,16 +91,16 @@ def render_unifamiliar_leigo(calc: Dict[str, Any], sim: Dict[str, Any]) -> None:
             f"Chuveiros {san_totals.get('chuveiros','—')}"
         )
 
-    def _render_option_card(key: str):
+    def _option_card_html(key: str) -> str:
         opt = options.get(key) or {}
         if not opt:
-            return
+            return ""
         area_max_terreo = opt.get("area_max_terreo_m2")
         area_miolo = opt.get("area_miolo_m2")
 
         to_eff = (float(area_max_terreo) / area_lote) if (area_max_terreo and area_lote > 0) else None
 
-        st.markdown(
+        html = dedent(
             f"""
             <div class="card" style="margin-top:10px;">
               <h4>{opt.get("label")}</h4>
@@ -120,17 +121,21 @@ def render_unifamiliar_leigo(calc: Dict[str, Any], sim: Dict[str, Any]) -> None:
               <div class="muted" style="margin-top:6px;">Limitador</div>
               <div class="big" style="font-size:14px;">{opt.get("motivo_limitador") or "—"}</div>
             </div>
-            """,
-            unsafe_allow_html=True,
+            """
         )
         if opt.get("legal_ref"):
-            st.caption(f"Base: {opt.get('legal_ref')}")
+            html += f'<div class="muted" style="font-size:0.875rem;">Base: {opt.get("legal_ref")}</div>\n'
+        return html
+
+    def _render_options(title: str) -> None:
+        # título + cards das opções numa emissão só
+        parts = [f"### {title}", _option_card_html("padrao")]
+        if options.get("alinhamento_art112"):
+            parts.append(_option_card_html("alinhamento_art112"))
+        st.markdown("\n\n".join(parts), unsafe_allow_html=True)
 
     if is_auto:
-        st.markdown(
-            "<div class='ok'><b>✅ Uso permitido na zona</b><br/>Abaixo estão os limites e o máximo viável para a tipologia escolhida (modo automático).</div>",
-            unsafe_allow_html=True,
-        )
+        status_html = "<div class='ok'><b>✅ Uso permitido na zona</b><br/>Abaixo estão os limites e o máximo viável para a tipologia escolhida (modo automático).</div>"
 
         total_max_viavel = float((sim or {}).get("total_proj_m2") or 0)
 
@@ -149,8 +154,10 @@ def render_unifamiliar_leigo(calc: Dict[str, Any], sim: Dict[str, Any]) -> None:
         else:
             dist_txt = f"Térreo até {_fmt_m2(terreo_max)} • Superiores ~ {_fmt_m2(por_pav_superior)} cada"
 
+        # status + resumo numa emissão só
         st.markdown(
             f"""
+            {status_html}
             <div class="card" style="margin-top:10px;">
               <h4>Resumo rápido (Unifamiliar • {tipologia})</h4>
 
@@ -180,10 +187,7 @@ def render_unifamiliar_leigo(calc: Dict[str, Any], sim: Dict[str, Any]) -> None:
             unsafe_allow_html=True,
         )
 
-        st.markdown("### 📌 Opções de implantação")
-        _render_option_card("padrao")
-        if options.get("alinhamento_art112"):
-            _render_option_card("alinhamento_art112")
+        _render_options("📌 Opções de implantação")
 
         with st.expander("🌿 Permeabilidade — como a lei conta os pisos (Art. 108)"):
             st.write("Nem todo piso externo conta 100% como área permeável. Exemplos:")
@@ -202,7 +206,6 @@ def render_unifamiliar_leigo(calc: Dict[str, Any], sim: Dict[str, Any]) -> None:
         if viable
         else "<div class='warn'><b>⚠️ Projeto excede algum limite</b><br/>Seu projeto excede TO e/ou IA (ver detalhes abaixo).</div>"
     )
-    st.markdown(status_html, unsafe_allow_html=True)
 
     footprint = (sim or {}).get("footprint_proj_m2")
     total_proj = (sim or {}).get("total_proj_m2")
@@ -210,8 +213,10 @@ def render_unifamiliar_leigo(calc: Dict[str, Any], sim: Dict[str, Any]) -> None:
 
     terreo_limit = (options.get("padrao") or {}).get("area_max_terreo_m2")
 
+    # status + card do projeto numa emissão só
     st.markdown(
         f"""
+        {status_html}
         <div class="card" style="margin-top:10px;">
           <h4>Seu projeto (Unifamiliar • {tipologia})</h4>
 
@@ -244,10 +249,7 @@ def render_unifamiliar_leigo(calc: Dict[str, Any], sim: Dict[str, Any]) -> None:
         unsafe_allow_html=True,
     )
 
-    st.markdown("### 📌 Opções de implantação (referência)")
-    _render_option_card("padrao")
-    if options.get("alinhamento_art112"):
-        _render_option_card("alinhamento_art112")
+    _render_options("📌 Opções de implantação (referência)")
 
     with st.expander("🌿 Permeabilidade — como a lei conta os pisos (Art. 108)"):
         st.write("Nem todo piso externo conta 100% como área permeável. Exemplos:")
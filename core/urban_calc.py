@@ -0,0 +1,161 @@
+"""Motor de cálculo urbanístico — áreas-limite da zona e envelope do lote (recuos).
+
+Só aritmética, sem Streamlit/Supabase: escalar, um lote por chamada
+(compute_urbanism em core/app_main.py).
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+
+def envelope_core(
+    testada: float,
+    profundidade: float,
+    rec_fr: float,
+    rec_fun: float,
+    rec_lat: float,
+    esquina: bool,
+    corner_two_fronts: bool,
+    attach_one_side: bool,
+) -> Tuple[float, float, float]:
+    """(largura_util, prof_util, area_miolo) do lote depois dos recuos."""
+    # geminar zera a lateral interna; na esquina com 2 frentes a lateral
+    # externa vira frente (recuo frontal)
+    lat_internal = 0.0 if attach_one_side else rec_lat
+    lat_other = rec_fr if (esquina and corner_two_fronts) else rec_lat
+    largura_util = max(testada - (lat_internal + lat_other), 0.0)
+    prof_util = max(profundidade - rec_fr - rec_fun, 0.0)
+    return largura_util, prof_util, largura_util * prof_util
+
+
+# (esquina, corner_two_fronts) -> modelo; fora da esquina "2 frentes" não conta
+MODEL_TABLE = {
+    (False, False): "meio_quadra",
+    (False, True): "meio_quadra",
+    (True, True): "esquina_2_frentes",
+    (True, False): "esquina_sem_2_frentes",
+}
+
+
+def esquina_modelo(esquina: bool, corner_two_fronts: bool) -> str:
+    return MODEL_TABLE[(bool(esquina), bool(corner_two_fronts))]
+
+
+def envelope_area(
+    testada: float,
+    profundidade: float,
+    rec_fr: float,
+    rec_fun: float,
+    rec_lat: float,
+    esquina: bool,
+    corner_two_fronts: bool,
+    attach_one_side: bool,
+) -> Dict[str, Any]:
+    largura_util, prof_util, area_miolo = envelope_core(
+        float(testada),
+        float(profundidade),
+        float(rec_fr),
+        float(rec_fun),
+        float(rec_lat),
+        bool(esquina),
+        bool(corner_two_fronts),
+        bool(attach_one_side),
+    )
+    return {
+        "largura_util": largura_util,
+        "prof_util": prof_util,
+        "area_miolo": area_miolo,
+        "esquina_modelo": esquina_modelo(esquina, corner_two_fronts),
+    }
+
+
+# campos numéricos da regra da zona que entram nas contas de área
+RULE_MATH_FIELDS = (
+    "to_max",
+    "tp_min",
+    "ia_max",
+    "to_sub_max",
+    "recuo_frontal_m",
+    "recuo_lateral_m",
+    "recuo_fundos_m",
+)
+
+
+def _area_or_none(rate: Any, area_lote: float) -> Optional[float]:
+    return float(rate) * area_lote if rate not in (None, "") else None
+
+
+@lru_cache(maxsize=256)
+def _urbanism_math(
+    rule_key: Tuple[Any, ...],
+    testada: float,
+    profundidade: float,
+    esquina: bool,
+    corner_two_fronts: bool,
+    attach_one_side: bool,
+) -> Dict[str, Any]:
+    to_max, tp_min, ia_max, to_sub_max, rec_fr, rec_lat, rec_fun = rule_key
+    area_lote = testada * profundidade
+
+    out: Dict[str, Any] = {
+        "area_max_ocupacao_to": _area_or_none(to_max, area_lote),
+        "area_min_permeavel": _area_or_none(tp_min, area_lote),
+        "area_max_total_construida": _area_or_none(ia_max, area_lote),
+        "area_max_subsolo": _area_or_none(to_sub_max, area_lote),
+        "largura_util_miolo": None,
+        "prof_util_miolo": None,
+        "area_miolo": None,
+        "esquina_modelo": None,
+    }
+    if rec_fr is not None and rec_lat is not None and rec_fun is not None:
+        largura_util, prof_util, area_miolo = envelope_core(
+            testada,
+            profundidade,
+            float(rec_fr),
+            float(rec_fun),
+            float(rec_lat),
+            esquina,
+            corner_two_fronts,
+            attach_one_side,
+        )
+        out["largura_util_miolo"] = largura_util
+        out["prof_util_miolo"] = prof_util
+        out["area_miolo"] = area_miolo
+        out["esquina_modelo"] = esquina_modelo(esquina, corner_two_fronts)
+
+    area_to = out["area_max_ocupacao_to"]
+    area_miolo = out["area_miolo"]
+    if area_to is not None and area_miolo is not None:
+        out["area_max_ocupacao_real"] = min(area_to, area_miolo)
+    else:
+        out["area_max_ocupacao_real"] = area_to if area_to is not None else area_miolo
+    return out
+
+
+def urbanism_math(
+    rule: Dict[str, Any],
+    testada: float,
+    profundidade: float,
+    esquina: bool,
+    corner_two_fronts: bool,
+    attach_one_side: bool,
+) -> Dict[str, Any]:
+    """Áreas-limite (TO/TP/IA/subsolo) + envelope dos recuos para uma regra.
+
+    Só depende dos campos numéricos da regra (RULE_MATH_FIELDS) e do lote:
+    o resultado fica em cache e volta como cópia (valores escalares).
+    """
+    rule_key = tuple(rule.get(k) for k in RULE_MATH_FIELDS)
+    return dict(
+        _urbanism_math(
+            rule_key,
+            float(testada),
+            float(profundidade),
+            bool(esquina),
+            bool(corner_two_fronts),
+            bool(attach_one_side),
+        )
+    )
+
@@ -3,7 +3,10 @@ def fmt_pct(ratio):
         return "—"
     return f"{ratio*100:.0f}%"
 
+# 1,234.56 -> 1.234,56: troca vírgula e ponto numa passada só
+_PT_BR_SEPARATORS = str.maketrans(",.", ".,")
+
 def fmt_m2(value):
     if value is None:
         return "—"
-    return f"{value:,.2f} m²".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"{value:,.2f} m²".translate(_PT_BR_SEPARATORS)
@@ -0,0 +1,43 @@
+-- Índices nas chaves de busca das tabelas de referência.
+--
+-- O app não filtra por estas colunas: carrega cada tabela inteira, paginada e
+-- ordenada por elas (sb_fetch_all em core/app_main.py, order + range). Em
+-- tabela grande o índice entrega essa ordem sem sort a cada página; nas
+-- tabelas atuais (pequenas) o planner tende a preferir Seq Scan + sort.
+-- Quem filtra por igualdade são as consultas fora do app: conferência de
+-- regras no SQL editor do Supabase e chamadas diretas à API REST
+-- (?zone_sigla=eq....&use_type_code=eq....), como as de exemplo abaixo.
+--
+-- zone_rules não recebe UNIQUE: a mesma (zona, uso) pode ter mais de uma linha
+-- por subzona (requires_subzone / subzone_code).
+
+create index if not exists zone_rules_zone_use_idx
+    on public.zone_rules (zone_sigla, use_type_code);
+
+create index if not exists parking_rules_use_idx
+    on public.parking_rules (use_type_code);
+
+create index if not exists parking_rules_v2_use_idx
+    on public.parking_rules_v2 (use_code);
+
+create index if not exists use_sanitary_profile_use_idx
+    on public.use_sanitary_profile (use_type_code);
+
+create index if not exists sanitary_profiles_profile_idx
+    on public.sanitary_profiles (sanitary_profile);
+
+-- Conferência das consultas por igualdade (SQL editor do Supabase); o plano
+-- deve mostrar "Index Scan" ou "Bitmap Index Scan" em vez de "Seq Scan":
+--
+--   explain analyze
+--   select * from public.zone_rules
+--   where zone_sigla = 'ZR1' and use_type_code = 'res_unifamiliar'
+--   limit 1;
+--
+--   explain analyze
+--   select * from public.parking_rules
+--   where use_type_code = 'res_unifamiliar'
+--   limit 1;
+--
+-- Em tabelas pequenas o planner pode preferir Seq Scan mesmo com o índice;
+-- para forçar a checagem: set enable_seqscan = off; (só na sessão).